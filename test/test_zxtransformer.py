@@ -18,13 +18,17 @@
 from typing import Optional, Callable
 
 import cirq
+import pytest
 import pyzx as zx
+from pyzx.circuit import gates as zx_gates
 
 from zxtransformer import ZXTransformer
+from zxtransformer.zxtransformer import cirq_gate_to_zx_gate
 
 
-def _run_zxtransformer(qc: cirq.Circuit, optimize: Optional[Callable[[zx.Circuit], zx.Circuit]] = None) -> None:
-    zx_transform = ZXTransformer(optimize)
+def _run_zxtransformer(qc: cirq.Circuit, optimize: Optional[Callable[[zx.Circuit], zx.Circuit]] = None,
+                       chunk_size: Optional[int] = None) -> None:
+    zx_transform = ZXTransformer(optimize, chunk_size=chunk_size)
     zx_qc = zx_transform(qc)
     qubit_map = {qid: qid for qid in qc.all_qubits()}
     cirq.testing.assert_circuits_have_same_unitary_given_final_permutation(qc, zx_qc, qubit_map)
@@ -107,3 +111,194 @@ def test_conditional_gate() -> None:
     zxtransformer = ZXTransformer()
     circuits_and_ops = zxtransformer._cirq_to_circuits_and_ops(circuit)  # pylint: disable=protected-access
     assert len(circuits_and_ops) == 3
+
+
+def test_gate_conversion() -> None:
+    """Test conversion of Cirq gates, including subclasses and unsupported exponents.
+    """
+    class CustomHPowGate(cirq.HPowGate):  # pylint: disable=abstract-method
+        """A user-defined subclass of a supported gate."""
+
+    assert isinstance(cirq_gate_to_zx_gate(cirq.X, [0]), zx_gates.XPhase)
+    assert isinstance(cirq_gate_to_zx_gate(cirq.rz(0.5), [0]), zx_gates.ZPhase)
+    assert isinstance(cirq_gate_to_zx_gate(CustomHPowGate(), [0]), zx_gates.HAD)
+    assert cirq_gate_to_zx_gate(cirq.MeasurementGate(1, key='c'), [0]) is None
+    with pytest.raises(ValueError):
+        cirq_gate_to_zx_gate(cirq.CZ**0.5, [0, 1])
+    assert isinstance(cirq_gate_to_zx_gate(cirq.CZ**0.5, [0, 1], strict=False), zx_gates.CZ)
+
+
+def test_recover_circuit() -> None:
+    """Test recovery of PyZX gates which are not produced by converting a Cirq circuit.
+    """
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit(cirq.H(q[0]), cirq.CX(q[0], q[1]))
+    zxtransformer = ZXTransformer()
+    zxtransformer._cirq_to_circuits_and_ops(circuit)  # pylint: disable=protected-access
+
+    zx_circuit = zx.Circuit(2)
+    zx_circuit.add_gate(zx_gates.NOT(0))
+    zx_circuit.add_gate(zx_gates.S(1, adjoint=True))
+    zx_circuit.add_gate(zx_gates.T(0))
+    zx_circuit.add_gate(zx_gates.SWAP(0, 1))
+    recovered = zxtransformer._recover_circuit([zx_circuit])  # pylint: disable=protected-access
+    q0, q1 = zxtransformer.qubits
+    expected = cirq.Circuit(cirq.X(q0), cirq.S(q1)**-1, cirq.T(q0), cirq.SWAP(q0, q1))
+    cirq.testing.assert_allclose_up_to_global_phase(cirq.unitary(recovered), cirq.unitary(expected), atol=1e-8)
+
+    zx_circuit = zx.Circuit(2)
+    zx_circuit.add_gate(zx_gates.XCX(0, 1))
+    with pytest.raises(ValueError):
+        zxtransformer._recover_circuit([zx_circuit])  # pylint: disable=protected-access
+
+
+def test_parallel_optimize() -> None:
+    """Test optimizing sub-circuits separated by measurements in worker processes.
+    """
+    q = cirq.LineQubit.range(3)
+    block = [cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CCZ(q[0], q[1], q[2]), cirq.CX(q[1], q[2]), cirq.H(q[2])]
+    circuit = cirq.Circuit(*block, cirq.measure(q[0], key='a'), *block, cirq.measure(q[1], key='b'), *block)
+
+    serial_qc = ZXTransformer()(circuit)
+    parallel_qc = ZXTransformer(max_workers=2)(circuit)
+    assert parallel_qc == serial_qc
+
+
+def test_chunk_size() -> None:
+    """Test splitting long runs of gates into PyZX sub-circuits of limited size.
+    """
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit([cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.CCZ(q[0], q[1], q[2]), cirq.CX(q[1], q[2])] * 5)
+
+    zxtransformer = ZXTransformer(chunk_size=6)
+    circuits_and_ops = zxtransformer._cirq_to_circuits_and_ops(circuit)  # pylint: disable=protected-access
+    assert [len(c.gates) for c in circuits_and_ops] == [6, 6, 6, 2]  # type: ignore
+
+    _run_zxtransformer(circuit, chunk_size=6)
+
+    for chunk_size in (0, -1):
+        with pytest.raises(ValueError):
+            ZXTransformer(chunk_size=chunk_size)
+
+
+def test_repeated_sub_circuits() -> None:
+    """Test that identical sub-circuits are only optimized once.
+    """
+    q = cirq.LineQubit.range(2)
+    block = [cirq.H(q[0]), cirq.CX(q[0], q[1]), cirq.H(q[1])]
+    circuit = cirq.Circuit(*block, cirq.measure(q[0], key='a'), *block, cirq.measure(q[0], key='b'), *block)
+
+    optimized_circuits = []
+
+    def optimize(circ: zx.Circuit) -> zx.Circuit:
+        optimized_circuits.append(circ)
+        return circ
+
+    zx_qc = ZXTransformer(optimize)(circuit)
+    assert len(optimized_circuits) == 1
+    assert zx_qc == circuit
+
+
+def test_qubit_order() -> None:
+    """Test that qubits are indexed in their natural order.
+    """
+    q = cirq.LineQubit.range(4)
+    circuit = cirq.Circuit(cirq.CX(q[3], q[1]), cirq.CZ(q[2], q[0]))
+    zxtransformer = ZXTransformer()
+    zxtransformer._cirq_to_circuits_and_ops(circuit)  # pylint: disable=protected-access
+    assert zxtransformer.qubits == q
+    assert zxtransformer.qubit_to_index == {q[0]: 0, q[1]: 1, q[2]: 2, q[3]: 3}
+
+
+def test_quizx_backend() -> None:
+    """Test the QuiZX backend, if it is installed.
+    """
+    pytest.importorskip('quizx')
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit(
+        cirq.H(q[0]),
+        cirq.T(q[1]),
+        cirq.CX(q[0], q[1]),
+        cirq.CCZ(q[0], q[1], q[2]),
+        cirq.S(q[0]),
+        cirq.CX(q[1], q[2]),
+        cirq.rz(0.3)(q[2]),
+        cirq.H(q[2]),
+        cirq.CZ(q[0], q[2]),
+    )
+
+    zx_qc = ZXTransformer(backend='quizx')(circuit)
+    qubit_map = {qid: qid for qid in circuit.all_qubits()}
+    cirq.testing.assert_circuits_have_same_unitary_given_final_permutation(circuit, zx_qc, qubit_map)
+
+
+def test_quizx_backend_parallel_optimize() -> None:
+    """Test optimizing sub-circuits separated by measurements in worker processes with the QuiZX backend.
+    """
+    pytest.importorskip('quizx')
+    q = cirq.LineQubit.range(3)
+    block = [cirq.H(q[0]), cirq.T(q[0]), cirq.CX(q[0], q[1]), cirq.S(q[1]), cirq.CCZ(q[0], q[1], q[2]),
+             cirq.CX(q[1], q[2]), cirq.rz(0.3)(q[2]), cirq.H(q[2])]
+    circuit = cirq.Circuit(*block, cirq.measure(q[0], key='a'), *block[:3], cirq.measure(q[1], key='b'), *block)
+
+    serial_qc = ZXTransformer(backend='quizx')(circuit)
+    parallel_qc = ZXTransformer(backend='quizx', max_workers=2)(circuit)
+    assert parallel_qc == serial_qc
+
+
+def test_reuse_qubit_indices() -> None:
+    """Test that qubit indices are reused for circuits on the same qubits, and rebuilt otherwise.
+    """
+    q = cirq.LineQubit.range(3)
+    zxtransformer = ZXTransformer()
+    zxtransformer._cirq_to_circuits_and_ops(cirq.Circuit(cirq.CX(q[0], q[1])))  # pylint: disable=protected-access
+    qubit_to_index = zxtransformer.qubit_to_index
+
+    zxtransformer._cirq_to_circuits_and_ops(cirq.Circuit(cirq.CZ(q[1], q[0])))  # pylint: disable=protected-access
+    assert zxtransformer.qubit_to_index is qubit_to_index
+
+    zxtransformer._cirq_to_circuits_and_ops(cirq.Circuit(cirq.CZ(q[2], q[0])))  # pylint: disable=protected-access
+    assert zxtransformer.qubit_to_index == {q[0]: 0, q[2]: 1}
+
+
+def test_no_supported_gates() -> None:
+    """Test a circuit without any gates supported by PyZX.
+    """
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit(
+        cirq.measure(q[0], key='a'),
+        cirq.measure(q[1], key='b'),
+        cirq.X(q[0]).with_classical_controls('b'),
+    )
+
+    zx_qc = ZXTransformer()(circuit)
+    assert zx_qc == circuit
+    assert zx_qc is not circuit
+
+
+def test_known_qubits() -> None:
+    """Test passing the qubits of the circuit instead of scanning it for them.
+    """
+    q = cirq.LineQubit.range(3)
+    circuit = cirq.Circuit(
+        cirq.H(q[0]),
+        cirq.CX(q[0], q[1]),
+        cirq.CCZ(q[0], q[1], q[2]),
+        cirq.CX(q[1], q[2]),
+        cirq.H(q[2]),
+    )
+
+    zxtransformer = ZXTransformer()
+    zx_qc = zxtransformer(circuit, known_qubits=q[::-1])
+    assert zxtransformer.qubits == q
+    assert zx_qc == ZXTransformer()(circuit)
+
+
+def test_known_qubits_missing_qubit() -> None:
+    """Test passing qubits which do not include every qubit of the circuit.
+    """
+    q = cirq.LineQubit.range(2)
+    circuit = cirq.Circuit(cirq.H(q[0]), cirq.CX(q[0], q[1]))
+
+    with pytest.raises(ValueError, match='known_qubits'):
+        ZXTransformer()(circuit, known_qubits=q[:1])
@@ -15,7 +15,10 @@
 
 """A custom transformer for Cirq which uses ZX-Calculus for circuit optimization, implemented using PyZX."""
 
-from typing import Dict, List, Callable, Optional, Union
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+from fractions import Fraction
+from typing import Dict, FrozenSet, List, Callable, Literal, Optional, Sequence, Tuple, Type, Union
 
 import cirq
 from cirq import circuits
@@ -23,109 +26,271 @@ from cirq import circuits
 import pyzx as zx
 from pyzx.circuit import gates as zx_gates
 
+try:
+    import quizx  # type: ignore
+except ImportError:
+    quizx = None  # type: ignore
 
-def cirq_gate_to_zx_gate(cirq_gate: Optional[cirq.Gate], qubits: List[int]) -> Optional[zx_gates.Gate]:
-    """Convert a Cirq gate to a PyZX gate."""
-    if cirq.Gate is None:
-        return None
 
-    if isinstance(cirq_gate, (cirq.Rx, cirq.XPowGate)):
-        return zx_gates.XPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
-    if isinstance(cirq_gate, (cirq.Ry, cirq.YPowGate)):
-        return zx_gates.YPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
-    if isinstance(cirq_gate, (cirq.Rz, cirq.ZPowGate)):
-        return zx_gates.ZPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
+def _x_phase(cirq_gate: cirq.Gate, qubits: List[int]) -> zx_gates.Gate:
+    return zx_gates.XPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
 
-    # TODO: Deal with exponents other than nice ones.
-    if isinstance(cirq_gate, cirq.HPowGate):
-        if cirq_gate.exponent != 1.0:
-            raise ValueError(f"Unsupported exponent: {cirq_gate}.")
-        return zx_gates.HAD(*qubits)
-    if isinstance(cirq_gate, cirq.CZPowGate):
-        if cirq_gate.exponent != 1.0:
-            raise ValueError(f"Unsupported exponent: {cirq_gate}.")
-        return zx_gates.CZ(*qubits)
-    if isinstance(cirq_gate, cirq.CNotPowGate):  # maybe CXPowGate?
-        if cirq_gate.exponent != 1.0:
-            raise ValueError(f"Unsupported exponent: {cirq_gate}.")
-        return zx_gates.CNOT(*qubits)
-    if isinstance(cirq_gate, cirq.SwapPowGate):
-        if cirq_gate.exponent != 1.0:
-            raise ValueError(f"Unsupported exponent: {cirq_gate}.")
-        return zx_gates.SWAP(*qubits)
-    if isinstance(cirq_gate, cirq.CCZPowGate):
-        if cirq_gate.exponent != 1.0:
+
+def _y_phase(cirq_gate: cirq.Gate, qubits: List[int]) -> zx_gates.Gate:
+    return zx_gates.YPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
+
+
+def _z_phase(cirq_gate: cirq.Gate, qubits: List[int]) -> zx_gates.Gate:
+    return zx_gates.ZPhase(*qubits, phase=cirq_gate.exponent)  # type: ignore
+
+
+def _fixed_exponent(zx_gate_type: Type[zx_gates.Gate],
+                    strict: bool = True) -> Callable[[cirq.Gate, List[int]], zx_gates.Gate]:
+    """Make a builder for a PyZX gate which only corresponds to the Cirq gate raised to the power 1. If not strict, the
+    exponent of the Cirq gate is assumed to be 1 without checking."""
+    if not strict:
+        return lambda cirq_gate, qubits: zx_gate_type(*qubits)
+
+    def build(cirq_gate: cirq.Gate, qubits: List[int]) -> zx_gates.Gate:
+        # TODO: Deal with exponents other than nice ones.
+        if cirq_gate.exponent != 1.0:  # type: ignore
             raise ValueError(f"Unsupported exponent: {cirq_gate}.")
-        return zx_gates.CCZ(*qubits)
+        return zx_gate_type(*qubits)
+    return build
+
+
+def _make_gate_dispatch(strict: bool) -> Dict[Type[cirq.Gate], Callable[[cirq.Gate, List[int]], zx_gates.Gate]]:
+    """Make the builders for PyZX gates, keyed on the exact type of the Cirq gate. Subclasses not listed here are
+    resolved by `isinstance` against the keys, in order, so base classes must come after any of their listed
+    subclasses."""
+    return {
+        type(cirq.X):       _x_phase,
+        cirq.Rx:            _x_phase,
+        cirq.XPowGate:      _x_phase,
+        type(cirq.Y):       _y_phase,
+        cirq.Ry:            _y_phase,
+        cirq.YPowGate:      _y_phase,
+        type(cirq.Z):       _z_phase,
+        cirq.Rz:            _z_phase,
+        cirq.ZPowGate:      _z_phase,
+        cirq.HPowGate:      _fixed_exponent(zx_gates.HAD, strict),
+        cirq.CZPowGate:     _fixed_exponent(zx_gates.CZ, strict),
+        cirq.CNotPowGate:   _fixed_exponent(zx_gates.CNOT, strict),
+        cirq.SwapPowGate:   _fixed_exponent(zx_gates.SWAP, strict),
+        cirq.CCZPowGate:    _fixed_exponent(zx_gates.CCZ, strict),
+    }
+
+
+_GATE_DISPATCH = _make_gate_dispatch(strict=True)
+_UNCHECKED_GATE_DISPATCH = _make_gate_dispatch(strict=False)
+
+
+def cirq_gate_to_zx_gate(cirq_gate: Optional[cirq.Gate], qubits: List[int],
+                         strict: bool = True) -> Optional[zx_gates.Gate]:
+    """Convert a Cirq gate to a PyZX gate. If not strict, gates which are only supported with exponent 1 are assumed to
+    have exponent 1 without checking."""
+    if cirq_gate is None:
+        return None
+
+    gate_dispatch = _GATE_DISPATCH if strict else _UNCHECKED_GATE_DISPATCH
+    builder = gate_dispatch.get(type(cirq_gate))
+    if builder is not None:
+        return builder(cirq_gate, qubits)
+    for gate_type, builder in gate_dispatch.items():
+        if isinstance(cirq_gate, gate_type):
+            return builder(cirq_gate, qubits)
 
     return None
 
 
-cirq_gate_table = {
-    'rx':   cirq.XPowGate,
-    'ry':   cirq.YPowGate,
-    'rz':   cirq.ZPowGate,
-    'h':    cirq.HPowGate,
-    'cx':   cirq.CXPowGate,
-    'cz':   cirq.CZPowGate,
-    'swap': cirq.SwapPowGate,
-    'ccz':  cirq.CCZPowGate,
+# How to recover a Cirq operation from a PyZX gate, keyed on the exact type of the PyZX gate (some PyZX gates subclass
+# different gates, e.g., `Tofolli` subclasses `CCZ`): the Cirq gate type, the attributes of the PyZX gate holding its
+# qubits (in Cirq argument order), and whether the PyZX gate's phase is the exponent of the Cirq gate (otherwise the
+# exponent is 1). The phase of an adjoint PyZX gate is already negated.
+_RECOVER_TABLE: Dict[Type[zx_gates.Gate], Tuple[Type[cirq.EigenGate], Tuple[str, ...], bool]] = {
+    zx_gates.XPhase:    (cirq.XPowGate, ('target',), True),
+    zx_gates.NOT:       (cirq.XPowGate, ('target',), True),
+    zx_gates.SX:        (cirq.XPowGate, ('target',), True),
+    zx_gates.YPhase:    (cirq.YPowGate, ('target',), True),
+    zx_gates.Y:         (cirq.YPowGate, ('target',), True),
+    zx_gates.ZPhase:    (cirq.ZPowGate, ('target',), True),
+    zx_gates.Z:         (cirq.ZPowGate, ('target',), True),
+    zx_gates.S:         (cirq.ZPowGate, ('target',), True),
+    zx_gates.T:         (cirq.ZPowGate, ('target',), True),
+    zx_gates.HAD:       (cirq.HPowGate, ('target',), False),
+    zx_gates.CNOT:      (cirq.CXPowGate, ('control', 'target'), False),
+    zx_gates.CZ:        (cirq.CZPowGate, ('control', 'target'), False),
+    zx_gates.SWAP:      (cirq.SwapPowGate, ('control', 'target'), False),
+    zx_gates.CCZ:       (cirq.CCZPowGate, ('ctrl1', 'ctrl2', 'target'), False),
+    zx_gates.Tofolli:   (cirq.CCXPowGate, ('ctrl1', 'ctrl2', 'target'), False),
 }
 
 
+def _make_recover_builder(gate_type: Type[cirq.EigenGate], qubit_attrs: Tuple[str, ...],
+                          has_phase: bool) -> Callable[[zx_gates.Gate, List[cirq.Qid]], cirq.Operation]:
+    """Generate a function which recovers a cirq.Operation from a PyZX gate, given the qubits indexed by PyZX, as
+    straight-line code without any lookups of attribute names."""
+    exponent = 'float(gate.phase)' if has_phase else '1.0'
+    qargs = ', '.join(f'qubits[gate.{attr}]' for attr in qubit_attrs)
+    namespace = {'gate_type': gate_type}
+    exec(f"def build(gate, qubits):\n    return gate_type(exponent={exponent})({qargs})\n",  # pylint: disable=exec-used
+         namespace)
+    return namespace['build']  # type: ignore
+
+
+_RECOVER_BUILDERS = {zx_gate_type: _make_recover_builder(*recover) for zx_gate_type, recover in _RECOVER_TABLE.items()}
+
+
+# The attributes of a PyZX gate which may hold its qubits, in Cirq argument order.
+_QUBIT_ATTRS = ('ctrl1', 'ctrl2', 'control', 'target')
+
+
+def _circuit_key(c: zx.Circuit) -> Tuple:
+    """Returns a hashable key which is equal for PyZX Circuits with the same gates on the same qubits."""
+    return c.qubits, tuple(
+        (gate.name, tuple(getattr(gate, attr) for attr in _QUBIT_ATTRS if hasattr(gate, attr)),
+         getattr(gate, 'phase', None))
+        for gate in c.gates)
+
+
 def _optimize(c: zx.Circuit) -> zx.Circuit:
     g = c.to_graph()
     zx.simplify.full_reduce(g)
     return zx.extract.extract_circuit(g)
 
 
+# The denominator to which float phases are rounded for QuiZX, whose phases are rationals of 64-bit integers. Using a
+# power of 2 keeps the denominators of sums of phases from growing (and overflowing) during simplification.
+_QUIZX_PHASE_DENOMINATOR = 2**32
+
+
+def _optimize_quizx(c: zx.Circuit) -> zx.Circuit:
+    # pylint: disable=no-member
+    # QuiZX graphs only accept phases with a numerator and denominator, but Cirq exponents are floats.
+    c = c.copy()
+    for gate in c.gates:
+        phase = getattr(gate, 'phase', None)
+        if isinstance(phase, float):
+            gate.phase = Fraction(round(phase * _QUIZX_PHASE_DENOMINATOR), _QUIZX_PHASE_DENOMINATOR)  # type: ignore
+    g = c.to_graph(backend='quizx-vec')
+    quizx.full_simp(g)  # type: ignore
+    return quizx.extract_circuit(g)  # type: ignore
+
+
 @cirq.transformer
-class ZXTransformer:  # pylint: disable=too-few-public-methods
+class ZXTransformer:  # pylint: disable=too-few-public-methods,too-many-instance-attributes
     """Transformer to do processing on an input circuit with pyzx."""
 
-    def __init__(self, optimize: Optional[Callable[[zx.Circuit], zx.Circuit]] = None):
+    def __init__(self, optimize: Optional[Callable[[zx.Circuit], zx.Circuit]] = None,  # pylint: disable=too-many-arguments
+                 max_workers: Optional[int] = None, chunk_size: Optional[int] = None,
+                 backend: Literal['pyzx', 'quizx'] = 'pyzx', strict: bool = True):
         """Initializes transformer.
 
         Args:
             optimize: The optimization routine to execute. Defaults to `pyzx.simplify.full_reduce` if not specified.
+              It must be deterministic, since it is only called once for identical PyZX sub-circuits, and the result
+              is reused for all of them.
+            max_workers: The maximum number of worker processes used to optimize independent PyZX sub-circuits (i.e.,
+              those separated by operations not supported by PyZX) in parallel. Defaults to optimizing them serially
+              in the current process. If more than one worker is used, `optimize` must be picklable. Worker processes
+              are also used with the 'quizx' backend, since the QuiZX bindings do not release the GIL.
+            chunk_size: The maximum number of gates in each PyZX sub-circuit. Longer runs of gates supported by PyZX are
+              split into several sub-circuits which are optimized independently. This misses some optimizations across
+              the splits, but avoids the super-linear cost of optimizing very large circuits. Defaults to no limit.
+            backend: The implementation of the default optimization routine, if `optimize` is not specified. Either
+              'pyzx', or 'quizx' to use the much faster Rust implementation of `full_simp` and circuit extraction
+              from QuiZX. Falls back to 'pyzx' with a warning if QuiZX is not installed.
+            strict: Whether to check that the gates which are only supported with exponent 1 (e.g., `cirq.H` and
+              `cirq.CZ`) have exponent 1, raising a `ValueError` otherwise. If False, the input circuit is assumed to
+              have been validated already, and such gates are converted as if their exponent were 1.
         """
 
         super().__init__()
+        if backend not in ('pyzx', 'quizx'):
+            raise ValueError(f"Unsupported backend: {backend}.")
+        if chunk_size is not None and chunk_size <= 0:
+            raise ValueError(f"Chunk size must be positive: {chunk_size}.")
+        if backend == 'quizx' and quizx is None:
+            warnings.warn("QuiZX is not installed, falling back to the PyZX backend.")
+            backend = 'pyzx'
+        self.backend = backend
         self.qubits: List[cirq.Qid] = []
         self.qubit_to_index: Dict[cirq.Qid, int] = {}
-        self.optimize: Callable[[zx.Circuit], zx.Circuit] = optimize or _optimize
-
-    def _cirq_to_circuits_and_ops(self, circuit: circuits.AbstractCircuit) -> List[Union[zx.Circuit, cirq.Operation]]:
+        self._qubit_set: FrozenSet[cirq.Qid] = frozenset()
+        self.optimize: Callable[[zx.Circuit], zx.Circuit] = \
+            optimize or (_optimize_quizx if backend == 'quizx' else _optimize)
+        self.max_workers = max_workers
+        self.chunk_size = chunk_size
+        self.strict = strict
+        self._gate_dispatch = _GATE_DISPATCH if strict else _UNCHECKED_GATE_DISPATCH
+
+    def _cirq_to_circuits_and_ops(  # pylint: disable=too-many-locals
+        self, circuit: circuits.AbstractCircuit, known_qubits: Optional[Sequence[cirq.Qid]] = None
+    ) -> List[Union[zx.Circuit, cirq.Operation]]:
         """Convert an AbstractCircuit to a list of PyZX Circuits and cirq.Operations. As much of the AbstractCircuit is
         converted to PyZX as possible, but some gates are not supported by PyZX and are left as cirq.Operations.
 
         :param circuit: The AbstractCircuit to convert.
+        :param known_qubits: The qubits of the AbstractCircuit, if already known, to avoid scanning it for them.
         :return: A list of PyZX Circuits and cirq.Operations corresponding to the AbstractCircuit.
         """
         circuits_and_ops: List[Union[zx.Circuit, cirq.Operation]] = []
-        self.qubits = [*circuit.all_qubits()]
-        self.qubit_to_index = {qubit: index for index, qubit in enumerate(self.qubits)}
+        qubit_set = circuit.all_qubits() if known_qubits is None else frozenset(known_qubits)
+        if qubit_set != self._qubit_set:
+            # Sort the qubits so that their indices in PyZX do not depend on the iteration order of a frozenset.
+            # These are reused for subsequent circuits on the same qubits.
+            circuit_qubits = sorted(qubit_set)
+            self.qubits = circuit_qubits
+            self.qubit_to_index = dict(zip(circuit_qubits, range(len(circuit_qubits))))
+            self._qubit_set = qubit_set
+        num_qubits = len(self.qubits)
+
+        # Bind frequently used callables to locals to avoid repeated attribute lookups in the loop below.
+        qubit_index = self.qubit_to_index.__getitem__
+        builder_for = self._gate_dispatch.get
+        convert = cirq_gate_to_zx_gate
+        strict = self.strict
+        append = circuits_and_ops.append
+        chunk_size = self.chunk_size
         current_circuit: Optional[zx.Circuit] = None
-        for moment in circuit:
-            for op in moment:
-                qubits = [self.qubit_to_index[qarg] for qarg in op.qubits]
-                gate = cirq_gate_to_zx_gate(op.gate, qubits)
-                if not gate:
-                    # Encountered an operation not supported by PyZX, so just store it.
-                    # Flush the current PyZX Circuit first if there is one.
-                    if current_circuit is not None:
-                        circuits_and_ops.append(current_circuit)
-                        current_circuit = None
-                    circuits_and_ops.append(op)
-                    continue
-
-                if current_circuit is None:
-                    current_circuit = zx.Circuit(len(self.qubits))
-                current_circuit.add_gate(gate)
+        gate: Optional[zx_gates.Gate]
+        add_gate: Callable[[zx_gates.Gate], None]
+        # The gates are appended directly to the list of gates of the PyZX Circuit, since they are already constructed
+        # and `zx.Circuit.add_gate` would only check whether it has been passed a gate name instead.
+        for op in circuit.all_operations():
+            try:
+                qubits = list(map(qubit_index, op.qubits))
+            except KeyError as error:
+                # Only possible if the qubits were passed in, since otherwise they come from the circuit itself.
+                raise ValueError(f"Qubit {error.args[0]} of {op} is missing from known_qubits.") from error
+            # Call the builder for the common gate types directly, only falling back to the full conversion (for
+            # subclasses and unsupported operations) if there is none.
+            cirq_gate = op.gate
+            builder = builder_for(type(cirq_gate))  # type: ignore
+            if builder is not None:
+                gate = builder(cirq_gate, qubits)  # type: ignore
+            else:
+                gate = convert(cirq_gate, qubits, strict)
+            if not gate:
+                # Encountered an operation not supported by PyZX, so just store it.
+                # Flush the current PyZX Circuit first if there is one.
+                if current_circuit is not None:
+                    append(current_circuit)
+                    current_circuit = None
+                append(op)
+                continue
+
+            if current_circuit is None:
+                current_circuit = zx.Circuit(num_qubits)
+                add_gate = current_circuit.gates.append
+            add_gate(gate)
+            if chunk_size and len(current_circuit.gates) >= chunk_size:
+                append(current_circuit)
+                current_circuit = None
 
         # Flush any remaining PyZX Circuit.
         if current_circuit is not None:
-            circuits_and_ops.append(current_circuit)
+            append(current_circuit)
 
         return circuits_and_ops
 
@@ -136,34 +301,47 @@ class ZXTransformer:  # pylint: disable=too-few-public-methods
                                  cirq.Circuit.
         :return: An optimized version of the original input circuit to ZXTransformer.
         """
-        cirq_circuit = circuits.Circuit()
+        # Collect all the operations first and build the circuit in one go, rather than placing each one separately.
+        ops: List[cirq.Operation] = []
+        append = ops.append
+        builder_for = _RECOVER_BUILDERS.get
+        qubits = self.qubits
         for circuit_or_op in circuits_and_ops:
             if isinstance(circuit_or_op, cirq.Operation):
-                cirq_circuit.append(circuit_or_op)
+                append(circuit_or_op)
                 continue
             for gate in circuit_or_op.gates:
-                gate_name = gate.qasm_name if not (hasattr(gate, 'adjoint') and gate.adjoint) \
-                    else gate.qasm_name_adjoint
-                gate_type = cirq_gate_table[gate_name]
-                if gate_type is None:
-                    raise ValueError(f"Unsupported gate: {gate_name}.")
-                qargs: List[cirq.Qid] = []
-                for attr in ['ctrl1', 'ctrl2', 'control', 'target']:
-                    if hasattr(gate, attr):
-                        qargs.append(self.qubits[getattr(gate, attr)])
-                params: List[float] = []
-                if hasattr(gate, 'phase'):
-                    params = [float(gate.phase)]
-                elif hasattr(gate, 'phases'):
-                    params = [float(phase) for phase in gate.phases]
-                elif gate_name in ('h', 'cz', 'cx', 'swap', 'ccz'):
-                    # TODO: Handle other exponents.
-                    params = [1.0]
-                cirq_circuit.append(gate_type(exponent=params[0])(*qargs))
-        return cirq_circuit
+                builder = builder_for(type(gate))
+                if builder is None:
+                    raise ValueError(f"Unsupported gate: {gate}.")
+                append(builder(gate, qubits))
+        return circuits.Circuit(ops, strategy=cirq.InsertStrategy.EARLIEST)
+
+    def _optimize_circuits(self, zx_circuits: List[zx.Circuit]) -> List[zx.Circuit]:
+        """Optimizes independent PyZX Circuits, in parallel worker processes if more than one worker is allowed.
+        Identical circuits (e.g., repeated blocks of a Trotterized circuit) are only optimized once.
+
+        :param zx_circuits: The PyZX Circuits to optimize.
+        :return: The optimized PyZX Circuits, in the same order.
+        """
+        keys = [_circuit_key(zx_circuit) for zx_circuit in zx_circuits]
+        unique: Dict[Tuple, zx.Circuit] = {}
+        for key, zx_circuit in zip(keys, zx_circuits):
+            unique.setdefault(key, zx_circuit)
+
+        max_workers = min(self.max_workers or 1, len(unique))
+        if max_workers < 2:
+            optimized = [self.optimize(zx_circuit) for zx_circuit in unique.values()]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                optimized = list(executor.map(self.optimize, unique.values()))
+
+        cache = dict(zip(unique, optimized))
+        return [cache[key] for key in keys]
 
     def __call__(
-        self, circuit: circuits.AbstractCircuit, context: Optional[cirq.TransformerContext] = None
+        self, circuit: circuits.AbstractCircuit, context: Optional[cirq.TransformerContext] = None, *,
+        known_qubits: Optional[Sequence[cirq.Qid]] = None
     ) -> circuits.Circuit:
         """Perform circuit optimization using pyzx.
 
@@ -171,17 +349,25 @@ class ZXTransformer:  # pylint: disable=too-few-public-methods
             circuit: 'cirq.Circuit' input circuit to transform.
             context: `cirq.TransformerContext` storing common configurable
               options for transformers.
+            known_qubits: The qubits of the input circuit, if already known (e.g., a fixed register), which avoids
+              scanning the circuit for them. Must include every qubit the circuit acts on.
 
         Returns:
             A copy of the modified circuit after optimization.
         """
-        circuits_and_ops = self._cirq_to_circuits_and_ops(circuit)
-        if not circuits_and_ops:
-            copied_circuit = circuit.unfreeze(copy=True)
-            return copied_circuit
-
-        circuits_and_ops = [self.optimize(circuit) if isinstance(circuit, zx.Circuit) else circuit
-                            for circuit in circuits_and_ops]
+        circuits_and_ops = self._cirq_to_circuits_and_ops(circuit, known_qubits)
+        if len(circuits_and_ops) == 1 and isinstance(circuits_and_ops[0], zx.Circuit):
+            # The whole circuit is supported by PyZX, so there is nothing to split or stitch back together.
+            return self._recover_circuit([self.optimize(circuits_and_ops[0])])
+
+        zx_indices = [index for index, circuit_or_op in enumerate(circuits_and_ops)
+                      if isinstance(circuit_or_op, zx.Circuit)]
+        if not zx_indices:
+            # The circuit is empty or none of its operations are supported by PyZX, so there is nothing to optimize.
+            return circuit.unfreeze(copy=True)
+        optimized = self._optimize_circuits([circuits_and_ops[index] for index in zx_indices])  # type: ignore
+        for index, optimized_circuit in zip(zx_indices, optimized):
+            circuits_and_ops[index] = optimized_circuit
 
         return self._recover_circuit(circuits_and_ops)
 